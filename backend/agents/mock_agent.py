@@ -4,14 +4,16 @@ Returns realistic sample analysis results without calling Anthropic API
 """
 
 import random
-from datetime import datetime, date, timedelta
+from datetime import date, timedelta
 from typing import Dict, List, Any, Optional
 
 # Import constants from the real agent
 from agents.report_agent import (
-    INDIAN_TEST_COSTS, 
     VALIDITY_PERIODS, 
-    TEST_NAME_ALIASES
+    CANONICAL_TEST_NAMES,
+    TEST_COST_LOOKUP,
+    VALIDITY_LOOKUP,
+    index_test_history,
 )
 
 
@@ -310,56 +312,43 @@ class MockReportIntelligenceAgent:
         
         return analysis
     
-    def _normalize_test_name(self, test_name: str) -> str:
+    def normalize_test_name(self, test_name: str) -> str:
         """Normalize test name to standard format"""
         if not test_name:
             return "Unknown Test"
         
-        lower_name = test_name.lower().strip()
-        
-        if lower_name in TEST_NAME_ALIASES:
-            return TEST_NAME_ALIASES[lower_name]
-        
-        for standard_name in INDIAN_TEST_COSTS.keys():
-            if lower_name == standard_name.lower():
-                return standard_name
+        canonical = CANONICAL_TEST_NAMES.get(test_name.lower().strip())
+        if canonical is not None:
+            return canonical
         
         return test_name.strip().title()
     
+    def index_test_history(
+        self, test_history: List[Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Map each normalized test name to its most recent history entry.
+        Build once per report and pass to detect_duplicate as indexed_history.
+        """
+        return index_test_history(test_history, self.normalize_test_name)
+    
     def detect_duplicate(
         self,
         test_name: str,
         test_date: date,
         test_history: List[Dict[str, Any]],
+        indexed_history: Optional[Dict[str, Dict[str, Any]]] = None,
     ) -> Dict[str, Any]:
         """
         Check if a test is a potential duplicate based on validity periods
         """
-        normalized_name = self._normalize_test_name(test_name)
+        normalized_name = self.normalize_test_name(test_name)
         validity_days = VALIDITY_PERIODS.get(normalized_name, VALIDITY_PERIODS["default"])
         
         # Find the most recent instance of this test
-        latest_test = None
-        for test in test_history:
-            hist_name = self._normalize_test_name(test.get("test_name", ""))
-            if hist_name == normalized_name:
-                hist_date_str = test.get("test_date", "")
-                try:
-                    if isinstance(hist_date_str, str):
-                        hist_date = datetime.strptime(hist_date_str[:10], "%Y-%m-%d").date()
-                    elif isinstance(hist_date_str, date):
-                        hist_date = hist_date_str
-                    else:
-                        continue
-                    
-                    if latest_test is None or hist_date > latest_test["date"]:
-                        latest_test = {
-                            "date": hist_date,
-                            "value": test.get("test_value"),
-                            "hospital": test.get("hospital_name"),
-                        }
-                except (ValueError, TypeError):
-                    continue
+        if indexed_history is None:
+            indexed_history = self.index_test_history(test_history)
+        latest_test = indexed_history.get(normalized_name)
         
         if not latest_test:
             return {
@@ -400,17 +389,20 @@ class MockReportIntelligenceAgent:
     
     def calculate_savings(self, test_name: str) -> float:
         """Calculate potential savings for a test"""
-        normalized_name = self._normalize_test_name(test_name)
-        return INDIAN_TEST_COSTS.get(normalized_name, 500)
+        if not test_name:
+            return 500
+        return TEST_COST_LOOKUP.get(test_name.lower().strip(), 500)
     
     def get_test_cost(self, test_name: str) -> float:
         """Get the cost of a specific test"""
-        normalized_name = self._normalize_test_name(test_name)
-        return INDIAN_TEST_COSTS.get(normalized_name, 500)
+        if not test_name:
+            return 500
+        return TEST_COST_LOOKUP.get(test_name.lower().strip(), 500)
     
     def get_validity_period(self, test_name: str) -> int:
         """Get the validity period of a specific test in days"""
-        normalized_name = self._normalize_test_name(test_name)
-        return VALIDITY_PERIODS.get(normalized_name, VALIDITY_PERIODS["default"])
+        if not test_name:
+            return VALIDITY_PERIODS["default"]
+        return VALIDITY_LOOKUP.get(test_name.lower().strip(), VALIDITY_PERIODS["default"])
 
 
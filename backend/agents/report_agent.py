@@ -6,11 +6,17 @@ Claude Sonnet integration for medical report analysis and duplicate detection
 import os
 import json
 import re
-from datetime import datetime, date, timedelta
-from typing import Dict, List, Any, Optional
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Any, Optional
 import anthropic
 from dotenv import load_dotenv
 
+try:
+    # C parser for Claude's JSON replies; raises a json.JSONDecodeError subclass
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 load_dotenv()
 
 
@@ -197,6 +203,61 @@ TEST_NAME_ALIASES = {
     "2d echo": "Echocardiography",
 }
 
+# Lowercased alias or standard name -> canonical name, built once so
+# normalization is a single dict lookup. Aliases win over standard names,
+# and the first standard name wins among case-insensitive duplicates.
+CANONICAL_TEST_NAMES: Dict[str, str] = {}
+for _name in INDIAN_TEST_COSTS:
+    CANONICAL_TEST_NAMES.setdefault(_name.lower(), _name)
+del _name
+CANONICAL_TEST_NAMES.update(TEST_NAME_ALIASES)
+
+# Cost and validity keyed on the same lowercased lookup names, so pricing a
+# test is one dict.get with no normalization round-trip
+TEST_COST_LOOKUP: Dict[str, int] = {
+    key: INDIAN_TEST_COSTS[name]
+    for key, name in CANONICAL_TEST_NAMES.items()
+    if name in INDIAN_TEST_COSTS
+}
+VALIDITY_LOOKUP: Dict[str, int] = {
+    key: VALIDITY_PERIODS[name]
+    for key, name in CANONICAL_TEST_NAMES.items()
+    if name in VALIDITY_PERIODS
+}
+
+
+def index_test_history(
+    test_history: List[Dict[str, Any]],
+    normalize: Callable[[str], str],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Map each test name (as normalized by `normalize`) to its most recent
+    history entry. Shared by the real and mock agents so their duplicate
+    detection reads history the same way.
+    """
+    latest: Dict[str, Dict[str, Any]] = {}
+    for test in test_history:
+        hist_date_str = test.get("test_date", "")
+        try:
+            if isinstance(hist_date_str, str):
+                hist_date = date.fromisoformat(hist_date_str[:10])
+            elif isinstance(hist_date_str, date):
+                hist_date = hist_date_str
+            else:
+                continue
+        except (ValueError, TypeError):
+            continue
+        
+        hist_name = normalize(test.get("test_name", ""))
+        current = latest.get(hist_name)
+        if current is None or hist_date > current["date"]:
+            latest[hist_name] = {
+                "date": hist_date,
+                "value": test.get("test_value"),
+                "hospital": test.get("hospital_name"),
+            }
+    return latest
+
 
 # System prompt for Claude
 REPORT_INTELLIGENCE_SYSTEM_PROMPT = """You are a medical report analysis expert specializing in Indian healthcare documents. Your role is to accurately extract structured data from medical lab reports, prescriptions, imaging reports, and diagnostic documents.
@@ -382,12 +443,12 @@ class ReportIntelligenceAgent:
             # Try to extract JSON from response
             json_match = re.search(r'\{[\s\S]*\}', response_text)
             if json_match:
-                result = json.loads(json_match.group())
+                result = json_loads(json_match.group())
                 
                 # Normalize test names
                 if "tests" in result:
                     for test in result["tests"]:
-                        test["test_name"] = self._normalize_test_name(test.get("test_name", ""))
+                        test["test_name"] = self.normalize_test_name(test.get("test_name", ""))
                 
                 return result
             else:
@@ -410,31 +471,34 @@ class ReportIntelligenceAgent:
             "confidence_score": 0.0,
         }
     
-    def _normalize_test_name(self, test_name: str) -> str:
+    def normalize_test_name(self, test_name: str) -> str:
         """Normalize test name to standard format"""
         if not test_name:
             return "Unknown Test"
         
-        # Convert to lowercase for lookup
-        lower_name = test_name.lower().strip()
-        
-        # Check aliases
-        if lower_name in TEST_NAME_ALIASES:
-            return TEST_NAME_ALIASES[lower_name]
-        
-        # Check if already a standard name (case-insensitive)
-        for standard_name in INDIAN_TEST_COSTS.keys():
-            if lower_name == standard_name.lower():
-                return standard_name
+        # Aliases and standard names (case-insensitive)
+        canonical = CANONICAL_TEST_NAMES.get(test_name.lower().strip())
+        if canonical is not None:
+            return canonical
         
         # Return original with title case
         return test_name.strip().title()
     
+    def index_test_history(
+        self, test_history: List[Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Map each normalized test name to its most recent history entry.
+        Build once per report and pass to detect_duplicate as indexed_history.
+        """
+        return index_test_history(test_history, self.normalize_test_name)
+    
     def detect_duplicate(
         self,
         test_name: str,
         test_date: date,
         test_history: List[Dict[str, Any]],
+        indexed_history: Optional[Dict[str, Dict[str, Any]]] = None,
     ) -> Dict[str, Any]:
         """
         Check if a test is a potential duplicate based on validity periods
@@ -443,37 +507,21 @@ class ReportIntelligenceAgent:
             test_name: Name of the new test
             test_date: Date of the new test
             test_history: User's previous test results
+            indexed_history: Optional result of index_test_history(test_history),
+                reused across calls for the same report
             
         Returns:
             Dictionary with duplicate detection results
         """
-        normalized_name = self._normalize_test_name(test_name)
+        normalized_name = self.normalize_test_name(test_name)
         
         # Get validity period for this test
         validity_days = VALIDITY_PERIODS.get(normalized_name, VALIDITY_PERIODS["default"])
         
         # Find the most recent instance of this test
-        latest_test = None
-        for test in test_history:
-            hist_name = self._normalize_test_name(test.get("test_name", ""))
-            if hist_name == normalized_name:
-                hist_date_str = test.get("test_date", "")
-                try:
-                    if isinstance(hist_date_str, str):
-                        hist_date = datetime.strptime(hist_date_str[:10], "%Y-%m-%d").date()
-                    elif isinstance(hist_date_str, date):
-                        hist_date = hist_date_str
-                    else:
-                        continue
-                    
-                    if latest_test is None or hist_date > latest_test["date"]:
-                        latest_test = {
-                            "date": hist_date,
-                            "value": test.get("test_value"),
-                            "hospital": test.get("hospital_name"),
-                        }
-                except (ValueError, TypeError):
-                    continue
+        if indexed_history is None:
+            indexed_history = self.index_test_history(test_history)
+        latest_test = indexed_history.get(normalized_name)
         
         # No previous test found
         if not latest_test:
@@ -517,18 +565,21 @@ class ReportIntelligenceAgent:
     
     def calculate_savings(self, test_name: str) -> float:
         """Calculate potential savings for a test"""
-        normalized_name = self._normalize_test_name(test_name)
-        return INDIAN_TEST_COSTS.get(normalized_name, 500)  # Default ₹500
+        if not test_name:
+            return 500
+        return TEST_COST_LOOKUP.get(test_name.lower().strip(), 500)  # Default ₹500
     
     def get_test_cost(self, test_name: str) -> float:
         """Get the cost of a specific test"""
-        normalized_name = self._normalize_test_name(test_name)
-        return INDIAN_TEST_COSTS.get(normalized_name, 500)
+        if not test_name:
+            return 500
+        return TEST_COST_LOOKUP.get(test_name.lower().strip(), 500)
     
     def get_validity_period(self, test_name: str) -> int:
         """Get the validity period of a specific test in days"""
-        normalized_name = self._normalize_test_name(test_name)
-        return VALIDITY_PERIODS.get(normalized_name, VALIDITY_PERIODS["default"])
+        if not test_name:
+            return VALIDITY_PERIODS["default"]
+        return VALIDITY_LOOKUP.get(test_name.lower().strip(), VALIDITY_PERIODS["default"])
 
 
 # Factory function to get the appropriate agent
@@ -2,6 +2,7 @@
 Authentication routes for signup, login, token refresh, and logout.
 """
 
+import asyncio
 from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import ValidationError
@@ -22,14 +23,14 @@ from utils.auth_utils import (
     REFRESH_TOKEN_EXPIRE_DAYS,
 )
 from database.supabase_client import get_db
-from middleware.auth_middleware import get_current_user
+from middleware.auth_middleware import get_current_user, invalidate_user_cache
 
 # Create router
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
 
 @router.post("/signup", response_model=TokenResponse, status_code=status.HTTP_201_CREATED)
-async def signup(user_data: UserSignup):
+async def signup(user_data: UserSignup, db=Depends(get_db)):
     """
     Register a new user account.
     
@@ -37,8 +38,6 @@ async def signup(user_data: UserSignup):
     access and refresh tokens for immediate login.
     """
     try:
-        db = get_db()
-        
         # Check if user already exists
         existing_user = db.get_user_by_email(user_data.email)
         if existing_user:
@@ -47,8 +46,8 @@ async def signup(user_data: UserSignup):
                 detail="Email already registered"
             )
         
-        # Hash password
-        password_hash = hash_password(user_data.password)
+        # Hash password off the event loop; bcrypt is deliberately slow
+        password_hash = await asyncio.to_thread(hash_password, user_data.password)
         
         # Create user
         user = db.create_auth_user(
@@ -95,15 +94,13 @@ async def signup(user_data: UserSignup):
 
 
 @router.post("/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, db=Depends(get_db)):
     """
     Log in with email and password.
     
     Validates credentials and returns access and refresh tokens.
     """
     try:
-        db = get_db()
-        
         # Get user by email
         user = db.get_user_by_email(credentials.email)
         if not user:
@@ -112,8 +109,11 @@ async def login(credentials: UserLogin):
                 detail="Invalid email or password"
             )
         
-        # Verify password
-        if not verify_password(credentials.password, user.get("password_hash", "")):
+        # Verify password off the event loop
+        password_ok = await asyncio.to_thread(
+            verify_password, credentials.password, user.get("password_hash", "")
+        )
+        if not password_ok:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
@@ -157,15 +157,13 @@ async def login(credentials: UserLogin):
 
 
 @router.post("/refresh", response_model=TokenResponse)
-async def refresh_access_token(request: RefreshTokenRequest):
+async def refresh_access_token(request: RefreshTokenRequest, db=Depends(get_db)):
     """
     Refresh access token using a valid refresh token.
     
     Returns a new access token while keeping the same refresh token.
     """
     try:
-        db = get_db()
-        
         # Verify refresh token
         payload = verify_token(request.refresh_token, token_type="refresh")
         if payload is None:
@@ -225,18 +223,25 @@ async def refresh_access_token(request: RefreshTokenRequest):
 
 
 @router.post("/logout")
-async def logout(request: RefreshTokenRequest):
+async def logout(request: RefreshTokenRequest, db=Depends(get_db)):
     """
     Log out by revoking the refresh token.
     
     This prevents the refresh token from being used to obtain new access tokens.
+    Access tokens that were already issued are not revoked and stay valid
+    until their own expiry (exp); clients should discard them on logout.
     """
     try:
-        db = get_db()
-        
         # Revoke the refresh token
         success = db.revoke_refresh_token(request.refresh_token)
         
+        # Drop this worker's cached user lookups. Housekeeping only: other
+        # workers keep their entries until USER_CACHE_TTL_SECONDS, and the
+        # access token itself stays valid until exp either way
+        payload = verify_token(request.refresh_token, token_type="refresh")
+        if payload and payload.get("sub"):
+            invalidate_user_cache(payload["sub"])
+        
         return {
             "success": success,
             "message": "Logged out successfully" if success else "Token not found"
@@ -5,7 +5,7 @@ In-memory storage that mimics Supabase operations
 
 import uuid
 from datetime import date, datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, BinaryIO, Union
 from copy import deepcopy
 
 # Test validity periods in days (how long each test result is typically valid)
@@ -510,12 +510,15 @@ class MockSupabaseClient:
     
     # ==================== STORAGE OPERATIONS ====================
     
-    def upload_image(self, file_bytes: bytes, filename: str, user_id: str) -> str:
-        """Upload an image to mock storage and return a fake URL"""
+    def upload_image(self, file: Union[bytes, BinaryIO], filename: str, user_id: str) -> str:
+        """Upload an image (bytes or file-like) to mock storage and return a fake URL"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         file_path = f"{user_id}/{timestamp}_{filename}"
         
-        self._images[file_path] = file_bytes
+        if not isinstance(file, (bytes, bytearray)):
+            file.seek(0)
+            file = file.read()
+        self._images[file_path] = bytes(file)
         
         # Return a mock URL
         return f"https://demo.swasthyapath.local/storage/{file_path}"
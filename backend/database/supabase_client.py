@@ -2,9 +2,10 @@
 Supabase client for Swasthya Path - Database operations
 """
 
+import io
 import os
 from datetime import date, datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, BinaryIO, Union
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -280,8 +281,33 @@ class SupabaseClient:
     
     # ==================== STORAGE OPERATIONS ====================
     
-    def upload_image(self, file_bytes: bytes, filename: str, user_id: str) -> str:
-        """Upload an image to Supabase storage and return the public URL"""
+    def _as_upload_body(self, file: Union[bytes, BinaryIO]):
+        """
+        Prepare an upload body for the storage client.
+        
+        Bytes are passed through. A SpooledTemporaryFile (the file behind an
+        UploadFile) that is still in memory is read directly, since asking it
+        for a descriptor would force a rollover to disk. File-likes backed by
+        a real descriptor are rewound and re-opened as a reader on it so the
+        storage client streams them instead of needing a second copy.
+        """
+        if isinstance(file, (bytes, bytearray)):
+            return bytes(file)
+        
+        file.seek(0)
+        if not getattr(file, "_rolled", True):
+            return file.read()
+        
+        try:
+            fd = file.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            # Other in-memory file-likes (e.g. BytesIO) have no descriptor
+            return file.read()
+        
+        return io.open(fd, "rb", closefd=False)
+    
+    def upload_image(self, file: Union[bytes, BinaryIO], filename: str, user_id: str) -> str:
+        """Upload an image (bytes or file-like) to Supabase storage and return the public URL"""
         # Create a unique path
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         file_path = f"{user_id}/{timestamp}_{filename}"
@@ -289,7 +315,7 @@ class SupabaseClient:
         # Upload to storage
         self.client.storage.from_(self.storage_bucket).upload(
             file_path,
-            file_bytes,
+            self._as_upload_body(file),
             {"content-type": "image/jpeg"}  # Adjust based on actual type
         )
         
@@ -4,6 +4,8 @@ FastAPI Backend Application
 """
 
 import os
+import asyncio
+import logging
 from datetime import datetime, date
 from typing import Optional
 from contextlib import asynccontextmanager
@@ -12,6 +14,7 @@ from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+from PIL import features as pil_features
 
 from models.schemas import (
     UploadReportResponse,
@@ -24,19 +27,69 @@ from models.schemas import (
     DuplicateDecision,
 )
 from database.supabase_client import get_db, is_demo_mode, reset_db
-from agents.report_agent import get_agent
+from agents.report_agent import get_agent, is_using_mock_agent
 from utils.image_processing import process_upload
+from utils.logging_utils import start_logging, stop_logging
 import auth_routes  # Authentication routes
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Nil UUID used for the startup warmup query: test_results.user_id is a UUID
+# column, so any other placeholder would be rejected by PostgREST
+WARMUP_USER_ID = "00000000-0000-0000-0000-000000000000"
+
+# Upper bound for each warmup call, so a slow upstream can't stall the warmup
+WARMUP_TIMEOUT_SECONDS = 5
+
+# The Claude warmup ping is a billed API request on every deploy/restart,
+# so it only runs when explicitly enabled
+ANTHROPIC_WARMUP = os.getenv("ANTHROPIC_WARMUP", "").lower() in ("true", "1", "yes")
+
+
+async def warm_up_clients(db, agent) -> None:
+    """Issue one cheap request per real client so the first upload doesn't pay for connection setup"""
+    if not is_demo_mode():
+        try:
+            await asyncio.wait_for(
+                asyncio.to_thread(db.get_test_results, WARMUP_USER_ID),
+                timeout=WARMUP_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"Database warmup failed: {e!r}")
+    
+    if ANTHROPIC_WARMUP and not is_using_mock_agent():
+        try:
+            client = agent.client.with_options(timeout=WARMUP_TIMEOUT_SECONDS, max_retries=0)
+            await asyncio.wait_for(
+                asyncio.to_thread(
+                    client.messages.create,
+                    model=agent.model,
+                    max_tokens=1,
+                    messages=[{"role": "user", "content": "warmup"}],
+                ),
+                timeout=WARMUP_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"Anthropic warmup failed: {e!r}")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler"""
     # Startup
-    print("🚀 Starting Swasthya Path API...")
+    start_logging()
+    logger.info("🚀 Starting Swasthya Path API...")
+    logger.info(f"🌐 CORS enabled for origins: {cors_origins}")
+    
+    # Pillow wheels bundle libjpeg-turbo; a source build against stock libjpeg
+    # makes compress_image's JPEG encode several times slower
+    if pil_features.check_feature("libjpeg_turbo"):
+        logger.info(f"🖼️ JPEG codec: libjpeg-turbo {pil_features.version_feature('libjpeg_turbo')}")
+    else:
+        logger.warning("JPEG codec is not libjpeg-turbo; image compression will be slower")
     
     # Reset DB singleton on restart to pick up code changes in development
     reset_db()
@@ -46,17 +99,21 @@ async def lifespan(app: FastAPI):
     agent = get_agent()
     
     if is_demo_mode():
-        print("=" * 50)
-        print("🎮 DEMO MODE ACTIVE")
-        print("   - Using in-memory database (no Supabase)")
-        print("   - Using simulated AI responses (no Anthropic)")
-        print("   - Pre-loaded with sample medical data")
-        print("   - Demo user: demo-user-123")
-        print("=" * 50)
+        logger.info(
+            "🎮 DEMO MODE ACTIVE - in-memory database (no Supabase), "
+            "simulated AI responses (no Anthropic), pre-loaded sample data, "
+            "demo user: demo-user-123"
+        )
+    
+    # Warm up real clients in the background so startup (and health checks)
+    # never wait on a slow upstream
+    app.state.warmup_task = asyncio.create_task(warm_up_clients(db, agent))
     
     yield
     # Shutdown
-    print("👋 Shutting down Swasthya Path API...")
+    app.state.warmup_task.cancel()
+    logger.info("👋 Shutting down Swasthya Path API...")
+    stop_logging()
 
 
 # Initialize FastAPI app
@@ -70,7 +127,6 @@ app = FastAPI(
 # CORS configuration
 cors_origins_env = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:3001")
 cors_origins = [origin.strip() for origin in cors_origins_env.split(",")]
-print(f"🌐 CORS enabled for origins: {cors_origins}")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
@@ -129,11 +185,31 @@ async def root():
 
 # ==================== REPORT UPLOAD ====================
 
+ALLOWED_UPLOAD_TYPES = ["image/jpeg", "image/png", "image/jpg", "application/pdf"]
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB limit
+
+
+def validate_upload(content_type: Optional[str], file_size: int) -> None:
+    """Reject uploads with an unsupported type or an empty/oversized body"""
+    if content_type not in ALLOWED_UPLOAD_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_UPLOAD_TYPES)}"
+        )
+    
+    if file_size == 0:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    
+    if file_size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
+
+
 @app.post("/api/upload-report", response_model=UploadReportResponse, tags=["Reports"])
 async def upload_report(
     file: UploadFile = File(..., description="Medical report image (JPEG, PNG) or PDF"),
     user_id: str = Form(..., description="User ID"),
     context: Optional[str] = Form(None, description="Optional context about the report"),
+    db=Depends(get_db),
 ):
     """
     Upload and analyze a medical report
@@ -146,38 +222,38 @@ async def upload_report(
     5. Returns analysis results and any duplicate alerts
     """
     try:
-        # Validate file type
-        allowed_types = ["image/jpeg", "image/png", "image/jpg", "application/pdf"]
-        if file.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
-            )
+        # Check size on the spooled upload before reading it into memory
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
+        validate_upload(file.content_type, file_size)
         
         # Read file
         file_bytes = await file.read()
-        if len(file_bytes) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        if len(file_bytes) > 10 * 1024 * 1024:  # 10MB limit
-            raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
         
         # Initialize services
-        db = get_db()
         agent = get_agent()
         
         # Ensure user exists
         db.get_or_create_user(user_id)
         
-        # Process image
-        base64_data, media_type, extracted_text = process_upload(file_bytes, file.content_type)
+        # Process image in a worker thread: PDF rendering and JPEG re-encoding
+        # are CPU-bound (Pillow and poppler release the GIL) and would
+        # otherwise stall every other request on the event loop
+        base64_data, media_type, extracted_text = await asyncio.to_thread(
+            process_upload, file_bytes, file.content_type
+        )
+        # Storage streams from file.file, so drop the raw copy now rather than
+        # holding up to 10MB per request through the Claude call
+        del file_bytes
         
         # Upload to storage (optional, may fail if bucket not configured)
         image_url = None
         try:
-            image_url = db.upload_image(file_bytes, file.filename or "report.jpg", user_id)
+            # Stream from the spooled upload rather than the in-memory copy
+            image_url = db.upload_image(file.file, file.filename or "report.jpg", user_id)
         except Exception as e:
-            print(f"Warning: Could not upload to storage: {e}")
+            logger.warning(f"Could not upload to storage: {e}")
         
         # Get user's test history for duplicate detection
         test_history = db.get_test_results(user_id)
@@ -225,17 +301,24 @@ async def upload_report(
         duplicate_alerts = []
         total_savings = 0.0
         
+        # Index the history once; tests never seen before can't be duplicates,
+        # so skip the full check for them
+        latest_by_test = agent.index_test_history(test_history)
+        
         for test in analysis.get("tests", []):
             test_name = test.get("test_name", "Unknown Test")
             
             # Check for duplicates
-            duplicate_info = agent.detect_duplicate(
-                test_name=test_name,
-                test_date=report_date,
-                test_history=test_history
-            )
+            duplicate_info = None
+            if agent.normalize_test_name(test_name) in latest_by_test:
+                duplicate_info = agent.detect_duplicate(
+                    test_name=test_name,
+                    test_date=report_date,
+                    test_history=test_history,
+                    indexed_history=latest_by_test
+                )
             
-            if duplicate_info["is_duplicate"]:
+            if duplicate_info and duplicate_info["is_duplicate"]:
                 # Create duplicate alert
                 alert = db.create_duplicate_alert(
                     user_id=user_id,
@@ -285,10 +368,10 @@ async def upload_report(
 async def update_duplicate_decision(
     alert_id: str,
     decision: DuplicateDecision,
+    db=Depends(get_db),
 ):
     """Update the decision for a duplicate alert (skip or proceed)"""
     try:
-        db = get_db()
         result = db.update_duplicate_decision(alert_id, decision.value)
         
         if not result:
@@ -309,10 +392,9 @@ async def update_duplicate_decision(
 # ==================== REPORTS ====================
 
 @app.get("/api/reports/{user_id}", response_model=ReportListResponse, tags=["Reports"])
-async def get_user_reports(user_id: str):
+async def get_user_reports(user_id: str, db=Depends(get_db)):
     """Get all reports for a user"""
     try:
-        db = get_db()
         reports = db.get_reports(user_id)
         
         return ReportListResponse(
@@ -325,10 +407,9 @@ async def get_user_reports(user_id: str):
 
 
 @app.get("/api/report/{report_id}", tags=["Reports"])
-async def get_report(report_id: str):
+async def get_report(report_id: str, db=Depends(get_db)):
     """Get a specific report by ID"""
     try:
-        db = get_db()
         report = db.get_report(report_id)
         
         if not report:
@@ -344,10 +425,9 @@ async def get_report(report_id: str):
 # ==================== TIMELINE ====================
 
 @app.get("/api/timeline/{user_id}", response_model=TimelineResponse, tags=["Timeline"])
-async def get_user_timeline(user_id: str):
+async def get_user_timeline(user_id: str, db=Depends(get_db)):
     """Get chronological timeline of all tests for a user"""
     try:
-        db = get_db()
         timeline = db.get_timeline(user_id)
         
         return TimelineResponse(
@@ -362,10 +442,9 @@ async def get_user_timeline(user_id: str):
 # ==================== SAVINGS ====================
 
 @app.get("/api/savings/{user_id}", response_model=SavingsResponse, tags=["Savings"])
-async def get_user_savings(user_id: str):
+async def get_user_savings(user_id: str, db=Depends(get_db)):
     """Get total savings from avoided duplicate tests"""
     try:
-        db = get_db()
         savings = db.get_savings_summary(user_id)
         
         return SavingsResponse(
@@ -381,10 +460,9 @@ async def get_user_savings(user_id: str):
 # ==================== DEMO ====================
 
 @app.post("/api/demo/setup", response_model=DemoSetupResponse, tags=["Demo"])
-async def setup_demo():
+async def setup_demo(db=Depends(get_db)):
     """Create demo user and sample data for testing"""
     try:
-        db = get_db()
         result = db.setup_demo_data()
         
         return DemoSetupResponse(
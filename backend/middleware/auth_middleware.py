@@ -3,7 +3,8 @@ Authentication middleware for FastAPI.
 Provides dependencies for protected routes.
 """
 
-from typing import Optional
+import time
+from typing import Optional, Dict, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
@@ -13,15 +14,80 @@ from database.supabase_client import get_db
 # HTTP Bearer authentication scheme
 security = HTTPBearer()
 
+# Short-lived cache of resolved users keyed by raw access token.
+# Saves a JWT decode + database lookup for bursts of requests from one user.
+# The cache is per worker process, so user changes (deactivation, role edits)
+# can take up to USER_CACHE_TTL_SECONDS to be seen by every worker.
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_SIZE = 10_000
+_user_cache: Dict[str, Tuple[float, dict]] = {}
+
+
+def _resolve_user(token: str, db) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Resolve an access token to a user, using the TTL cache when possible.
+    
+    Args:
+        token: Raw JWT access token
+        db: Database client used on cache miss
+        
+    Returns:
+        Tuple of (user, error_detail). user is None when resolution fails.
+    """
+    now = time.time()
+    cached = _user_cache.get(token)
+    if cached is not None:
+        expires_at, user = cached
+        if now < expires_at:
+            return dict(user), None
+        _user_cache.pop(token, None)
+    
+    # Verify and decode token
+    payload = verify_token(token, token_type="access")
+    if payload is None:
+        return None, "Invalid or expired token"
+    
+    # Extract user ID from token
+    user_id = payload.get("sub")
+    if user_id is None:
+        return None, "Invalid token payload"
+    
+    # Get user from database
+    user = db.get_user_by_id(user_id)
+    if user is None:
+        return None, "User not found"
+    
+    # Never serve a cached user past the token's own expiry
+    expires_at = min(now + USER_CACHE_TTL_SECONDS, payload.get("exp", now))
+    if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+        _user_cache.pop(next(iter(_user_cache)))
+    _user_cache[token] = (expires_at, dict(user))
+    
+    return user, None
+
+
+def invalidate_user_cache(user_id: str) -> None:
+    """Drop all of this process's cached entries for a user (e.g. on logout)"""
+    for token, (_, user) in list(_user_cache.items()):
+        if user.get("id") == user_id:
+            _user_cache.pop(token, None)
+
+
+def clear_user_cache() -> None:
+    """Clear the resolved-user cache"""
+    _user_cache.clear()
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
+    db=Depends(get_db),
 ):
     """
     Dependency to get the current authenticated user from JWT token.
     
     Args:
         credentials: HTTP Bearer token from Authorization header
+        db: Database client
         
     Returns:
         User dictionary with user information
@@ -32,33 +98,12 @@ async def get_current_user(
     # Extract token from credentials
     token = credentials.credentials
     
-    # Verify and decode token
-    payload = verify_token(token, token_type="access")
-    
-    if payload is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    # Extract user ID from token
-    user_id = payload.get("sub")
-    if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token payload",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    # Get user from database
-    db = get_db()
-    user = db.get_user_by_id(user_id)
+    user, error = _resolve_user(token, db)
     
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
+            detail=error,
             headers={"WWW-Authenticate": "Bearer"},
         )
     
@@ -74,6 +119,7 @@ async def get_current_user(
 
 async def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+    db=Depends(get_db),
 ) -> Optional[dict]:
     """
     Optional authentication dependency.
@@ -82,6 +128,7 @@ async def get_current_user_optional(
     
     Args:
         credentials: Optional HTTP Bearer token
+        db: Database client
         
     Returns:
         User dictionary if authenticated, None otherwise
@@ -90,18 +137,7 @@ async def get_current_user_optional(
         return None
         
     try:
-        token = credentials.credentials
-        payload = verify_token(token, token_type="access")
-        
-        if payload is None:
-            return None
-            
-        user_id = payload.get("sub")
-        if user_id is None:
-            return None
-            
-        db = get_db()
-        user = db.get_user_by_id(user_id)
+        user, _ = _resolve_user(credentials.credentials, db)
         
         if user and user.get("is_active", True):
             return user
@@ -6,9 +6,16 @@ Phase 1: Backend Unit Tests Setup
 
 import pytest
 import os
+import re
+import sys
+import compileall
+import functools
+import json
+import tempfile
 from datetime import date, datetime
-from unittest.mock import MagicMock, AsyncMock, patch
+from unittest.mock import Mock, MagicMock, AsyncMock, patch
 import io
+import PIL
 from PIL import Image
 
 # Set test environment before importing app modules
@@ -19,41 +26,190 @@ os.environ.setdefault("SUPABASE_KEY", "test-key")
 from fastapi.testclient import TestClient
 
 
-@pytest.fixture
-def client():
-    """Create test client for FastAPI app"""
-    # Import inside fixture to ensure env vars are set
-    with patch('database.supabase_client.create_client'):
-        with patch('agents.report_agent.anthropic.Anthropic'):
-            from main import app
-            return TestClient(app)
+def pytest_configure(config):
+    """Pin the JWT secret once per process (each xdist worker runs this)"""
+    os.environ.setdefault("JWT_SECRET_KEY", "test-jwt-secret-key")
+    
+    # Byte-compile the app once in the controller so every xdist worker
+    # imports main and its dependencies from warm .pyc files
+    if not hasattr(config, "workerinput") and not sys.dont_write_bytecode:
+        compileall.compile_dir(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            rx=re.compile(r"[/\\](tests|htmlcov)[/\\]"),
+            quiet=1,
+        )
+
+
+def fake_hash_password(password: str) -> str:
+    """Cheap stand-in for bcrypt hashing in tests"""
+    return f"fake${password}"
+
+
+def fake_verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Cheap stand-in for bcrypt verification in tests"""
+    return hashed_password == fake_hash_password(plain_password)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def supabase_env():
+    """Point every test at the fake Supabase project, even if real creds are exported"""
+    with patch.dict(os.environ, {
+        'SUPABASE_URL': 'https://test.supabase.co',
+        'SUPABASE_KEY': 'test-key'
+    }):
+        yield
+
+
+@pytest.fixture(scope="session", autouse=True)
+def anthropic_stub():
+    """Stub the Anthropic client class and API key once for the whole run"""
+    with patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}), \
+         patch('agents.report_agent.anthropic.Anthropic') as anthropic_cls:
+        yield anthropic_cls
+
+
+@pytest.fixture(autouse=True)
+def reset_db_singleton():
+    """
+    Clear the get_db singleton, and any lru_cache'd helpers in the database
+    module, around every test so no test sees another's client.
+    """
+    import database.supabase_client as db_module
+    
+    def clear():
+        db_module.reset_db()
+        for attr in vars(db_module).values():
+            if callable(getattr(attr, "cache_clear", None)):
+                attr.cache_clear()
+    
+    clear()
+    yield
+    clear()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_password_hashing():
+    """Replace bcrypt (BCRYPT_ROUNDS work factor, deliberately slow) for the whole run"""
+    import auth_routes
+    with patch('utils.auth_utils.hash_password', fake_hash_password), \
+         patch('utils.auth_utils.verify_password', fake_verify_password), \
+         patch.object(auth_routes, 'hash_password', fake_hash_password), \
+         patch.object(auth_routes, 'verify_password', fake_verify_password):
+        yield
+
+
+@pytest.fixture(scope="session")
+def session_mock_db():
+    """Single mock database client injected into the app for the whole run"""
+    from database.supabase_client import SupabaseClient
+    # spec restricts attributes to the real client's API (and catches typos)
+    return MagicMock(spec=SupabaseClient)
+
+
+@pytest.fixture(scope="session")
+def app_instance():
+    """Import main once (after the test env vars above are set) and share its app"""
+    # Supabase and Anthropic clients are built lazily by get_db()/get_agent(),
+    # so importing main constructs neither and needs no patching
+    import main
+    return main.app
+
+
+@pytest.fixture(scope="session")
+def client(app_instance, session_mock_db):
+    """Create test client for FastAPI app (shared across the whole run)"""
+    from database.supabase_client import get_db
+    
+    app_instance.dependency_overrides[get_db] = lambda: session_mock_db
+    test_client = TestClient(app_instance)
+    # Run lifespan startup once for the session; the startup hook looks up
+    # services directly, so point it at mocks to skip the warmup calls
+    with patch('main.get_db', return_value=session_mock_db), \
+         patch('main.get_agent'), \
+         patch('main.is_using_mock_agent', return_value=True):
+        test_client.__enter__()
+    yield test_client
+    test_client.__exit__(None, None, None)
+    app_instance.dependency_overrides.clear()
 
 
 @pytest.fixture
-def sample_image_bytes():
-    """Create a valid test JPEG image"""
-    img = Image.new('RGB', (100, 100), color='red')
+def mock_db(session_mock_db):
+    """Mock database client used by the app, reset for each test"""
+    session_mock_db.reset_mock(return_value=True, side_effect=True)
+    return session_mock_db
+
+
+@functools.lru_cache(maxsize=None)
+def _encode_image(mode, size, fmt, color=0, **save_kwargs):
+    """Encode a solid-color image once per distinct set of arguments"""
     buffer = io.BytesIO()
-    img.save(buffer, format='JPEG')
+    Image.new(mode, size, color=color).save(buffer, format=fmt, **save_kwargs)
     return buffer.getvalue()
 
 
-@pytest.fixture
-def sample_png_bytes():
+def _cached_image_bytes(request, color, size, fmt, **save_kwargs):
+    """
+    Encode a solid-color test image, reusing bytes from pytest's cache dir
+    across runs. The key includes the Pillow version and every encode param.
+    """
+    def encode():
+        return _encode_image('RGB', size, fmt, color, **save_kwargs)
+    
+    cache = getattr(request.config, "cache", None)
+    if cache is None:  # cacheprovider disabled (-p no:cacheprovider)
+        return encode()
+    
+    params = "".join(f"-{k}{v}" for k, v in sorted(save_kwargs.items()))
+    name = f"{color}-{size[0]}x{size[1]}{params}.{fmt.lower()}"
+    path = cache.mkdir(f"sample-images-pillow-{PIL.__version__}") / name
+    if path.exists():
+        return path.read_bytes()
+    data = encode()
+    # xdist workers share the cache dir: write aside and rename into place so
+    # no worker ever reads a partially written file
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as tmp:
+        tmp.write(data)
+    os.replace(tmp.name, path)
+    return data
+
+
+@pytest.fixture(scope="session")
+def sample_image_bytes(request):
+    """Create a valid test JPEG image"""
+    return _cached_image_bytes(request, 'red', (100, 100), 'JPEG')
+
+
+@pytest.fixture(scope="session")
+def sample_png_bytes(request):
     """Create a valid test PNG image"""
-    img = Image.new('RGB', (100, 100), color='blue')
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    return buffer.getvalue()
+    return _cached_image_bytes(request, 'blue', (100, 100), 'PNG')
 
 
-@pytest.fixture
-def sample_large_image_bytes():
+@pytest.fixture(scope="session")
+def sample_large_image_bytes(request):
     """Create a large test image that needs compression"""
-    img = Image.new('RGB', (3000, 3000), color='green')
-    buffer = io.BytesIO()
-    img.save(buffer, format='JPEG', quality=100)
-    return buffer.getvalue()
+    # Source blob only, not a quality reference: skip the Huffman optimize pass
+    return _cached_image_bytes(request, 'green', (3000, 3000), 'JPEG', quality=75, optimize=False)
+
+
+@pytest.fixture(scope="session")
+def image_bytes():
+    """
+    Factory for encoded test images: image_bytes(mode, size, fmt, color, **save).
+    Each distinct image is encoded once per session; the bytes are immutable.
+    """
+    return _encode_image
+
+
+@pytest.fixture(scope="session")
+def warm_pdf_parser():
+    """
+    Run one throwaway PDF parse so PyPDF2's lazy first-use setup is paid once
+    per session, not inside whichever PDF test happens to run first
+    """
+    from utils.image_processing import extract_pdf_text
+    extract_pdf_text(b'%PDF-1.4\n%%EOF\n')
 
 
 @pytest.fixture
@@ -62,20 +218,48 @@ def sample_pdf_bytes():
     return b'%PDF-1.4 test content for extraction'
 
 
-@pytest.fixture
-def mock_supabase():
-    """Mock Supabase client for database tests"""
-    with patch('database.supabase_client.create_client') as mock:
-        instance = MagicMock()
-        mock.return_value = instance
-        yield instance
+# Query-builder chains SupabaseClient issues after table(...), ending in execute()
+SUPABASE_QUERY_CHAINS = (
+    ("insert", "execute"),
+    ("update", "eq", "execute"),
+    ("select", "eq", "execute"),
+    ("select", "eq", "eq", "execute"),
+    ("select", "eq", "order", "execute"),
+    ("select", "eq", "eq", "order", "execute"),
+    ("select", "eq", "eq", "order", "limit", "execute"),
+)
+
+
+def _prebuild_query_chains(mock_supabase):
+    """Materialize every table() query chain once and return the execute() mocks"""
+    executes = []
+    for chain in SUPABASE_QUERY_CHAINS:
+        node = mock_supabase.table.return_value
+        for name in chain[:-1]:
+            node = getattr(node, name).return_value
+        executes.append(getattr(node, chain[-1]))
+    return executes
+
+
+@pytest.fixture(scope="module")
+def supabase_client():
+    """
+    SupabaseClient wired to a mock Supabase API, built once per test module.
+    Yields (client, mock_supabase, execute_mocks) with the query chains prebuilt.
+    """
+    # Plain Mock: the query-builder chain never touches dunder methods
+    mock_supabase = Mock()
+    executes = _prebuild_query_chains(mock_supabase)
+    with patch('database.supabase_client.create_client', return_value=mock_supabase):
+        from database.supabase_client import SupabaseClient
+        yield SupabaseClient(), mock_supabase, executes
 
 
 @pytest.fixture
 def mock_anthropic():
     """Mock Anthropic Claude API for AI tests"""
     with patch('agents.report_agent.anthropic.Anthropic') as mock:
-        instance = MagicMock()
+        instance = Mock()
         mock.return_value = instance
         yield instance
 
@@ -111,9 +295,9 @@ def sample_test_history():
     ]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_claude_response():
-    """Sample Claude API response for report analysis"""
+    """Sample Claude API response for report analysis (treat as read-only)"""
     return {
         "report_type": "lab_test",
         "hospital_name": "Apollo Diagnostics",
@@ -143,6 +327,12 @@ def sample_claude_response():
     }
 
 
+@pytest.fixture(scope="session")
+def sample_claude_response_text(sample_claude_response):
+    """sample_claude_response encoded once as Claude's reply text"""
+    return json.dumps(sample_claude_response)
+
+
 @pytest.fixture
 def sample_report_data():
     """Sample medical report data"""
@@ -1,45 +1,47 @@
 import pytest
-from fastapi.testclient import TestClient
+from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
-from main import app
-from main import app
-from database.supabase_client import get_db
+from middleware.auth_middleware import clear_user_cache
+from tests.conftest import fake_hash_password
 
 # Mock data
 MOCK_USER_ID = "test-user-123"
 MOCK_EMAIL = "test@example.com"
 MOCK_PASSWORD = "securepassword123"
-MOCK_HASHED_PASSWORD = "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW"
 
 
 
-@pytest.fixture
-def mock_db():
-    """Mock database client"""
-    mock = MagicMock()
-    # Setup default behaviors
-    mock.create_auth_user.return_value = {
+@pytest.fixture(autouse=True)
+def auth_db_defaults(mock_db):
+    """Default behaviors for the shared mock database client"""
+    mock_db.create_auth_user.return_value = {
         "id": MOCK_USER_ID,
         "email": MOCK_EMAIL,
         "name": "Test User"
     }
-    mock.get_user_by_email.return_value = {
+    mock_db.get_user_by_email.return_value = {
         "id": MOCK_USER_ID,
         "email": MOCK_EMAIL,
-        "password": "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW" # hashed "password123"
+        "name": "Test User",
+        "password_hash": fake_hash_password(MOCK_PASSWORD)
     }
-    mock.verify_refresh_token.return_value = True
-    return mock
-
-@pytest.fixture
-def auth_client(mock_db):
-    """Test client with mocked database"""
-    def override_get_db():
-        return mock_db
-    
-    app.dependency_overrides[get_db] = override_get_db
-    yield TestClient(app)
-    app.dependency_overrides.clear()
+    mock_db.verify_refresh_token.return_value = True
+
+@pytest.fixture(autouse=True)
+def clear_auth_cache():
+    """Keep cached token lookups from leaking between tests"""
+    yield
+    clear_user_cache()
+
+@pytest.fixture(scope="session")
+def fake_bearer_headers():
+    """Authorization header carrying a token that is never really signed"""
+    return {"Authorization": "Bearer fake-token"}
+
+@pytest.fixture(scope="session")
+def auth_client(client):
+    """Test client with mocked database (shared across the session)"""
+    return client
 
 def test_signup_success(auth_client, mock_db):
     """Test successful user signup"""
@@ -75,39 +77,38 @@ def test_signup_duplicate_email(auth_client, mock_db):
 
 def test_login_success(auth_client, mock_db):
     """Test successful login"""
-    # We need to mock verify_password since we're using a real hash but maybe different salt
-    with patch('utils.auth_utils.verify_password', return_value=True):
-        response = auth_client.post("/api/auth/login", json={
-            "email": MOCK_EMAIL,
-            "password": MOCK_PASSWORD
-        })
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert data["token_type"] == "bearer"
-        assert "access_token" in data
-        assert "refresh_token" in data
+    response = auth_client.post("/api/auth/login", json={
+        "email": MOCK_EMAIL,
+        "password": MOCK_PASSWORD
+    })
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["token_type"] == "bearer"
+    assert "access_token" in data
+    assert "refresh_token" in data
 
 def test_login_invalid_credentials(auth_client, mock_db):
     """Test login with wrong password"""
-    with patch('utils.auth_utils.verify_password', return_value=False):
-        response = auth_client.post("/api/auth/login", json={
-            "email": MOCK_EMAIL,
-            "password": "wrongpassword"
-        })
-        
-        assert response.status_code == 401
-        assert "Invalid email or password" in response.json()["detail"]
+    response = auth_client.post("/api/auth/login", json={
+        "email": MOCK_EMAIL,
+        "password": "wrongpassword"
+    })
+    
+    assert response.status_code == 401
+    assert "Invalid email or password" in response.json()["detail"]
 
-def test_protected_route_access(auth_client):
+def test_protected_route_access(auth_client, mock_db, fake_bearer_headers):
     """Test accessing protected route with valid token"""
-    # Create a valid token
-    from utils.auth_utils import create_access_token
-    token = create_access_token(data={"sub": MOCK_USER_ID})
+    mock_db.get_user_by_id.return_value = {
+        "id": MOCK_USER_ID,
+        "email": MOCK_EMAIL,
+        "name": "Test User"
+    }
     
-    response = auth_client.get("/api/auth/me", headers={
-        "Authorization": f"Bearer {token}"
-    })
+    with patch('middleware.auth_middleware.verify_token',
+               return_value={"sub": MOCK_USER_ID, "type": "access"}):
+        response = auth_client.get("/api/auth/me", headers=fake_bearer_headers)
     
     assert response.status_code == 200
     data = response.json()
@@ -121,16 +122,41 @@ def test_protected_route_no_token(auth_client):
 
 def test_refresh_token_success(auth_client, mock_db):
     """Test refreshing access token"""
-    from utils.auth_utils import create_refresh_token
-    refresh_token = create_refresh_token(data={"sub": MOCK_EMAIL, "user_id": MOCK_USER_ID})
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    mock_db.get_refresh_token.return_value = {"expires_at": expires_at.isoformat()}
+    mock_db.get_user_by_id.return_value = {
+        "id": MOCK_USER_ID,
+        "email": MOCK_EMAIL,
+        "name": "Test User"
+    }
 
-    # Mock verify_token to return valid payload (since we can't easily rely on real verification if keys differ)
-    with patch('utils.auth_utils.verify_token') as mock_verify_jwt:
+    # Fake verification so no real refresh token has to be signed
+    with patch('auth_routes.verify_token') as mock_verify_jwt:
         mock_verify_jwt.return_value = {"sub": MOCK_USER_ID, "type": "refresh"}
         
         response = auth_client.post("/api/auth/refresh", json={
-            "refresh_token": refresh_token
+            "refresh_token": "fake-refresh-token"
         })
         
         assert response.status_code == 200
         assert "access_token" in response.json()
+
+def test_resolved_user_is_cached():
+    """Repeated lookups for the same token should hit the database once"""
+    from utils.auth_utils import create_access_token
+    from middleware import auth_middleware
+    
+    token = create_access_token(data={"sub": MOCK_USER_ID})
+    mock = MagicMock()
+    mock.get_user_by_id.return_value = {"id": MOCK_USER_ID, "name": "Test User"}
+    
+    user1, _ = auth_middleware._resolve_user(token, mock)
+    user2, _ = auth_middleware._resolve_user(token, mock)
+    
+    assert user1 == user2
+    assert mock.get_user_by_id.call_count == 1
+    
+    # Logout invalidates cached entries for the user
+    auth_middleware.invalidate_user_cache(MOCK_USER_ID)
+    auth_middleware._resolve_user(token, mock)
+    assert mock.get_user_by_id.call_count == 2
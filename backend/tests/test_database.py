@@ -5,111 +5,102 @@ Phase 5: Database Client Tests
 """
 
 import pytest
-import os
+import tempfile
 from datetime import date
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from database.supabase_client import SupabaseClient, get_db
+
+# Shared dates and rows
+REPORT_DATE = date(2024, 11, 15)
+ORIGINAL_TEST_DATE = date(2024, 10, 15)
+USER_ROW = {"id": "user-123", "name": "Test User"}
+REPORT_ROW = {"id": "report-123", "report_type": "lab_test"}
+STORAGE_URL = "https://storage.example.com/image.jpg"
+
+
+def query_result(mock_supabase, *chain):
+    """Result object returned by table().<chain>().execute() on the mock client"""
+    node = mock_supabase.table.return_value
+    for name in chain:
+        node = getattr(node, name).return_value
+    return node.execute.return_value
+
+
+@pytest.fixture
+def mock_client(supabase_client):
+    """Module-wide client and its mock Supabase API, reset for each test"""
+    client, mock_supabase, executes = supabase_client
+    # Keep the prebuilt query chains; only clear calls and swap in fresh results
+    mock_supabase.table.reset_mock(side_effect=True)
+    for execute in executes:
+        execute.return_value = SimpleNamespace(data=None)
+    # Storage isn't prebuilt: drop the subtree and let it rebuild lazily
+    mock_supabase.storage._mock_children.clear()
+    mock_supabase.mock_calls.clear()
+    mock_supabase.method_calls.clear()
+    return client, mock_supabase
 
 
 class TestSupabaseClientInit:
     """Tests for SupabaseClient initialization"""
 
-    def test_init_without_url_raises(self):
+    def test_init_without_url_raises(self, monkeypatch):
         """Should raise error without SUPABASE_URL"""
-        with patch.dict(os.environ, {'SUPABASE_URL': '', 'SUPABASE_KEY': 'test-key'}, clear=True):
-            with pytest.raises(ValueError, match="SUPABASE_URL"):
-                from database.supabase_client import SupabaseClient
-                import importlib
-                import database.supabase_client as db_module
-                importlib.reload(db_module)
-                db_module.SupabaseClient()
-
-    def test_init_without_key_raises(self):
+        monkeypatch.delenv('SUPABASE_URL', raising=False)
+        
+        with pytest.raises(ValueError, match="SUPABASE_URL"):
+            SupabaseClient()
+
+    def test_init_without_key_raises(self, monkeypatch):
         """Should raise error without SUPABASE_KEY"""
-        with patch.dict(os.environ, {'SUPABASE_URL': 'https://test.supabase.co', 'SUPABASE_KEY': ''}, clear=True):
-            with pytest.raises(ValueError):
-                from database.supabase_client import SupabaseClient
-                import importlib
-                import database.supabase_client as db_module
-                importlib.reload(db_module)
-                db_module.SupabaseClient()
+        monkeypatch.delenv('SUPABASE_KEY', raising=False)
+        monkeypatch.delenv('SUPABASE_SERVICE_KEY', raising=False)
+        
+        with pytest.raises(ValueError, match="SUPABASE_KEY"):
+            SupabaseClient()
 
 
 class TestUserOperations:
     """Tests for user CRUD operations"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
-    def test_create_user_basic(self, mock_client):
-        """Should create user with name only"""
+    @pytest.mark.parametrize("kwargs,rows", [
+        pytest.param({}, [USER_ROW], id="basic"),
+        pytest.param(
+            {"age": 30, "gender": "Male", "user_id": "user-123"},
+            [{"id": "user-123", "name": "Test User", "age": 30, "gender": "Male"}],
+            id="all_fields",
+        ),
+        pytest.param({}, [], id="empty_response"),
+    ])
+    def test_create_user(self, mock_client, kwargs, rows):
+        """Should create user (None if insert returns empty data)"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
-            {"id": "user-123", "name": "Test User"}
-        ]
+        query_result(mock_supabase, "insert").data = rows
         
-        result = client.create_user("Test User")
+        result = client.create_user("Test User", **kwargs)
         
-        assert result["name"] == "Test User"
+        assert result == (rows[0] if rows else None)
         mock_supabase.table.assert_called_with("users")
 
-    def test_create_user_with_all_fields(self, mock_client):
-        """Should create user with all optional fields"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
-            {"id": "user-123", "name": "Test User", "age": 30, "gender": "Male"}
-        ]
-        
-        result = client.create_user("Test User", age=30, gender="Male", user_id="user-123")
-        
-        assert result["name"] == "Test User"
-        assert result["age"] == 30
-        assert result["gender"] == "Male"
-
-    def test_create_user_returns_none_on_empty_response(self, mock_client):
-        """Should return None if insert returns empty data"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = []
-        
-        result = client.create_user("Test User")
-        
-        assert result is None
-
-    def test_get_user_found(self, mock_client):
-        """Should return user when found"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
-            {"id": "user-123", "name": "Test User"}
-        ]
-        
-        result = client.get_user("user-123")
-        
-        assert result["id"] == "user-123"
-        assert result["name"] == "Test User"
-
-    def test_get_user_not_found(self, mock_client):
-        """Should return None when user not found"""
+    @pytest.mark.parametrize("user_id,rows", [
+        pytest.param("user-123", [USER_ROW], id="found"),
+        pytest.param("nonexistent", [], id="not_found"),
+    ])
+    def test_get_user(self, mock_client, user_id, rows):
+        """Should return user when found, None otherwise"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = []
+        query_result(mock_supabase, "select", "eq").data = rows
         
-        result = client.get_user("nonexistent")
+        result = client.get_user(user_id)
         
-        assert result is None
+        assert result == (rows[0] if rows else None)
 
     def test_get_or_create_user_existing(self, mock_client):
         """Should return existing user"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq").data = [
             {"id": "user-123", "name": "Existing User"}
         ]
         
@@ -122,8 +113,8 @@ class TestUserOperations:
         client, mock_supabase = mock_client
         # First call returns empty (user not found)
         # Second call returns created user
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = []
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq").data = []
+        query_result(mock_supabase, "insert").data = [
             {"id": "user-123", "name": "Demo User"}
         ]
         
@@ -135,40 +126,25 @@ class TestUserOperations:
 class TestReportOperations:
     """Tests for medical report operations"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
     def test_create_report_basic(self, mock_client):
         """Should create report with required fields"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "insert").data = [
             {"id": "report-123", "report_type": "lab_test", "report_date": "2024-11-15"}
         ]
         
         result = client.create_report(
             user_id="user-123",
             report_type="lab_test",
-            report_date=date(2024, 11, 15)
+            report_date=REPORT_DATE
         )
         
-        assert result["id"] == "report-123"
-        assert result["report_type"] == "lab_test"
+        assert result == {"id": "report-123", "report_type": "lab_test", "report_date": "2024-11-15"}
 
     def test_create_report_with_all_fields(self, mock_client):
         """Should create report with all optional fields"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "insert").data = [
             {
                 "id": "report-123",
                 "report_type": "lab_test",
@@ -180,19 +156,24 @@ class TestReportOperations:
         result = client.create_report(
             user_id="user-123",
             report_type="lab_test",
-            report_date=date(2024, 11, 15),
+            report_date=REPORT_DATE,
             hospital_name="Apollo Hospital",
             doctor_name="Dr. Sharma",
             raw_image_url="https://example.com/image.jpg",
             extracted_data={"tests": []}
         )
         
-        assert result["hospital_name"] == "Apollo Hospital"
+        assert result == {
+            "id": "report-123",
+            "report_type": "lab_test",
+            "hospital_name": "Apollo Hospital",
+            "doctor_name": "Dr. Sharma"
+        }
 
     def test_create_report_with_string_date(self, mock_client):
         """Should handle string date format"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "insert").data = [
             {"id": "report-123"}
         ]
         
@@ -204,69 +185,45 @@ class TestReportOperations:
         
         assert result is not None
 
-    def test_get_reports(self, mock_client):
-        """Should return all user reports"""
+    @pytest.mark.parametrize("data,expected", [
+        pytest.param(
+            [{"id": "1", "report_type": "lab_test"}, {"id": "2", "report_type": "imaging"}],
+            [{"id": "1", "report_type": "lab_test"}, {"id": "2", "report_type": "imaging"}],
+            id="two_reports",
+        ),
+        pytest.param([], [], id="empty_list"),
+        pytest.param(None, [], id="none"),
+    ])
+    def test_get_reports(self, mock_client, data, expected):
+        """Should return all user reports, an empty list when there are none"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.execute.return_value.data = [
-            {"id": "1", "report_type": "lab_test"},
-            {"id": "2", "report_type": "imaging"}
-        ]
+        query_result(mock_supabase, "select", "eq", "order").data = data
         
         result = client.get_reports("user-123")
         
-        assert len(result) == 2
+        assert result == expected
 
-    def test_get_reports_empty(self, mock_client):
-        """Should return empty list when no reports"""
+    @pytest.mark.parametrize("report_id,rows", [
+        pytest.param("report-123", [REPORT_ROW], id="found"),
+        pytest.param("nonexistent", [], id="not_found"),
+    ])
+    def test_get_report(self, mock_client, report_id, rows):
+        """Should return specific report, None when not found"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.execute.return_value.data = None
+        query_result(mock_supabase, "select", "eq").data = rows
         
-        result = client.get_reports("user-123")
+        result = client.get_report(report_id)
         
-        assert result == []
-
-    def test_get_report_found(self, mock_client):
-        """Should return specific report"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
-            {"id": "report-123", "report_type": "lab_test"}
-        ]
-        
-        result = client.get_report("report-123")
-        
-        assert result["id"] == "report-123"
-
-    def test_get_report_not_found(self, mock_client):
-        """Should return None when report not found"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = []
-        
-        result = client.get_report("nonexistent")
-        
-        assert result is None
+        assert result == (rows[0] if rows else None)
 
 
 class TestTestResultOperations:
     """Tests for test result operations"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
     def test_create_test_result(self, mock_client):
         """Should create test result"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "insert").data = [
             {"id": "test-123", "test_name": "HbA1c"}
         ]
         
@@ -274,7 +231,7 @@ class TestTestResultOperations:
             report_id="report-123",
             user_id="user-123",
             test_name="HbA1c",
-            test_date=date(2024, 11, 15)
+            test_date=REPORT_DATE
         )
         
         assert result["test_name"] == "HbA1c"
@@ -282,7 +239,7 @@ class TestTestResultOperations:
     def test_create_test_result_with_all_fields(self, mock_client):
         """Should create test result with all fields"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "insert").data = [
             {
                 "id": "test-123",
                 "test_name": "HbA1c",
@@ -297,7 +254,7 @@ class TestTestResultOperations:
             report_id="report-123",
             user_id="user-123",
             test_name="HbA1c",
-            test_date=date(2024, 11, 15),
+            test_date=REPORT_DATE,
             test_category="blood",
             test_value="5.8",
             test_unit="%",
@@ -305,12 +262,19 @@ class TestTestResultOperations:
             status="abnormal"
         )
         
-        assert result["test_value"] == "5.8"
+        assert result == {
+            "id": "test-123",
+            "test_name": "HbA1c",
+            "test_value": "5.8",
+            "test_unit": "%",
+            "reference_range": "4.0-5.6%",
+            "status": "abnormal"
+        }
 
     def test_get_test_results(self, mock_client):
         """Should get all test results for user"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq", "order").data = [
             {"test_name": "HbA1c"},
             {"test_name": "CBC"}
         ]
@@ -322,7 +286,7 @@ class TestTestResultOperations:
     def test_get_test_history(self, mock_client):
         """Should get history of specific test"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.order.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq", "eq", "order").data = [
             {"test_name": "HbA1c", "test_date": "2024-11-15"},
             {"test_name": "HbA1c", "test_date": "2024-08-15"}
         ]
@@ -331,55 +295,34 @@ class TestTestResultOperations:
         
         assert len(result) == 2
 
-    def test_get_latest_test(self, mock_client):
-        """Should get most recent test result"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.order.return_value.limit.return_value.execute.return_value.data = [
-            {"test_name": "HbA1c", "test_date": "2024-11-15"}
-        ]
-        
-        result = client.get_latest_test("user-123", "HbA1c")
-        
-        assert result["test_date"] == "2024-11-15"
-
-    def test_get_latest_test_not_found(self, mock_client):
-        """Should return None when no test found"""
+    @pytest.mark.parametrize("test_name,rows", [
+        pytest.param("HbA1c", [{"test_name": "HbA1c", "test_date": "2024-11-15"}], id="found"),
+        pytest.param("NonexistentTest", [], id="not_found"),
+    ])
+    def test_get_latest_test(self, mock_client, test_name, rows):
+        """Should get most recent test result, None when no test found"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.order.return_value.limit.return_value.execute.return_value.data = []
+        query_result(mock_supabase, "select", "eq", "eq", "order", "limit").data = rows
         
-        result = client.get_latest_test("user-123", "NonexistentTest")
+        result = client.get_latest_test("user-123", test_name)
         
-        assert result is None
+        assert result == (rows[0] if rows else None)
 
 
 class TestDuplicateAlertOperations:
     """Tests for duplicate alert operations"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
     def test_create_duplicate_alert(self, mock_client):
         """Should create duplicate alert"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "insert").data = [
             {"id": "alert-123", "new_test_name": "HbA1c"}
         ]
         
         result = client.create_duplicate_alert(
             user_id="user-123",
             new_test_name="HbA1c",
-            original_test_date=date(2024, 10, 15),
+            original_test_date=ORIGINAL_TEST_DATE,
             days_since_original=30,
             alert_message="Duplicate detected",
             savings_amount=700
@@ -387,41 +330,24 @@ class TestDuplicateAlertOperations:
         
         assert result["new_test_name"] == "HbA1c"
 
-    def test_update_duplicate_decision_skip(self, mock_client):
-        """Should update decision to skip"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.update.return_value.eq.return_value.execute.return_value.data = [
-            {"id": "alert-123", "decision": "skip"}
-        ]
-        
-        result = client.update_duplicate_decision("alert-123", "skip")
-        
-        assert result["decision"] == "skip"
-
-    def test_update_duplicate_decision_proceed(self, mock_client):
-        """Should update decision to proceed"""
+    @pytest.mark.parametrize("alert_id,decision,rows", [
+        pytest.param("alert-123", "skip", [{"id": "alert-123", "decision": "skip"}], id="skip"),
+        pytest.param("alert-123", "proceed", [{"id": "alert-123", "decision": "proceed"}], id="proceed"),
+        pytest.param("nonexistent", "skip", [], id="not_found"),
+    ])
+    def test_update_duplicate_decision(self, mock_client, alert_id, decision, rows):
+        """Should update the decision, None for a non-existent alert"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.update.return_value.eq.return_value.execute.return_value.data = [
-            {"id": "alert-123", "decision": "proceed"}
-        ]
+        query_result(mock_supabase, "update", "eq").data = rows
         
-        result = client.update_duplicate_decision("alert-123", "proceed")
+        result = client.update_duplicate_decision(alert_id, decision)
         
-        assert result["decision"] == "proceed"
-
-    def test_update_duplicate_decision_not_found(self, mock_client):
-        """Should return None for non-existent alert"""
-        client, mock_supabase = mock_client
-        mock_supabase.table.return_value.update.return_value.eq.return_value.execute.return_value.data = []
-        
-        result = client.update_duplicate_decision("nonexistent", "skip")
-        
-        assert result is None
+        assert result == (rows[0] if rows else None)
 
     def test_get_duplicate_alerts(self, mock_client):
         """Should get all duplicate alerts for user"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq", "order").data = [
             {"id": "1", "new_test_name": "HbA1c"},
             {"id": "2", "new_test_name": "Lipid Profile"}
         ]
@@ -433,117 +359,117 @@ class TestDuplicateAlertOperations:
     def test_get_savings_summary(self, mock_client):
         """Should calculate total savings from skipped tests"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq", "eq").data = [
             {"savings_amount": 700, "new_test_name": "HbA1c", "created_at": "2024-11-15T00:00:00"},
             {"savings_amount": 1000, "new_test_name": "Lipid Profile", "created_at": "2024-11-14T00:00:00"}
         ]
         
         result = client.get_savings_summary("user-123")
         
-        assert result["total_savings"] == 1700
-        assert result["tests_skipped"] == 2
-        assert len(result["breakdown"]) == 2
+        assert result == {
+            "total_savings": 1700,
+            "tests_skipped": 2,
+            "breakdown": [
+                {"test_name": "HbA1c", "date_skipped": "2024-11-15", "amount_saved": 700},
+                {"test_name": "Lipid Profile", "date_skipped": "2024-11-14", "amount_saved": 1000}
+            ]
+        }
 
     def test_get_savings_summary_empty(self, mock_client):
         """Should return zero savings when no skipped tests"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value.data = []
+        query_result(mock_supabase, "select", "eq", "eq").data = []
         
         result = client.get_savings_summary("user-123")
         
-        assert result["total_savings"] == 0
-        assert result["tests_skipped"] == 0
+        assert result == {"total_savings": 0, "tests_skipped": 0, "breakdown": []}
 
 
 class TestStorageOperations:
     """Tests for storage operations"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
     def test_upload_image(self, mock_client):
         """Should upload image and return URL"""
         client, mock_supabase = mock_client
         mock_supabase.storage.from_.return_value.upload.return_value = None
-        mock_supabase.storage.from_.return_value.get_public_url.return_value = "https://storage.example.com/image.jpg"
+        mock_supabase.storage.from_.return_value.get_public_url.return_value = STORAGE_URL
         
         result = client.upload_image(b"image_bytes", "test.jpg", "user-123")
         
-        assert result == "https://storage.example.com/image.jpg"
+        assert result == STORAGE_URL
         mock_supabase.storage.from_.assert_called_with("medical-reports")
 
+    def test_upload_image_from_file(self, mock_client, tmp_path):
+        """Should stream file-like uploads from their descriptor"""
+        client, mock_supabase = mock_client
+        mock_supabase.storage.from_.return_value.get_public_url.return_value = STORAGE_URL
+        
+        path = tmp_path / "report.jpg"
+        path.write_bytes(b"image_bytes")
+        with open(path, "rb") as f:
+            f.read()  # Upload should rewind
+            result = client.upload_image(f, "test.jpg", "user-123")
+            
+            body = mock_supabase.storage.from_.return_value.upload.call_args.args[1]
+            assert body.read() == b"image_bytes"
+        
+        assert result == STORAGE_URL
+
+    def test_upload_image_from_spooled_file_stays_in_memory(self, mock_client):
+        """Should read an in-memory spooled upload without rolling it to disk"""
+        client, mock_supabase = mock_client
+        mock_supabase.storage.from_.return_value.get_public_url.return_value = STORAGE_URL
+        
+        with tempfile.SpooledTemporaryFile(max_size=1024) as f:
+            f.write(b"image_bytes")
+            client.upload_image(f, "test.jpg", "user-123")
+            
+            body = mock_supabase.storage.from_.return_value.upload.call_args.args[1]
+            assert body == b"image_bytes"
+            assert not f._rolled
+
 
 class TestTimelineOperations:
     """Tests for timeline operations"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
     def test_get_timeline(self, mock_client):
-        """Should return timeline with duplicate indicators"""
+        """Should return timeline with hospital names and duplicate indicators"""
         client, mock_supabase = mock_client
-        
-        # Mock test results
-        mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.execute.return_value.data = [
-            {"id": "1", "test_name": "HbA1c", "report_id": "report-1", "test_date": "2024-11-15", "status": "normal"}
-        ]
-        
-        # Mock reports
-        mock_reports = MagicMock()
-        mock_reports.data = [{"id": "report-1", "hospital_name": "Apollo"}]
-        
-        # Mock duplicate alerts
-        mock_alerts = MagicMock()
-        mock_alerts.data = []
+        rows = {
+            "test_results": [
+                {"id": "1", "test_name": "HbA1c", "report_id": "report-1", "test_date": "2024-11-15", "status": "normal"},
+                {"id": "2", "test_name": "Lipid Profile", "report_id": "report-2", "test_date": "2024-10-01"},
+            ],
+            "medical_reports": [{"id": "report-1", "hospital_name": "Apollo"}],
+            "duplicate_alerts": [{"new_test_name": "HbA1c", "created_at": "2024-11-15T10:00:00"}],
+        }
+        
+        # All three reads share the select().eq().order() chain, so route by table
+        def table(name):
+            query = Mock()
+            query.select.return_value.eq.return_value.order.return_value.execute.return_value = \
+                SimpleNamespace(data=rows[name])
+            return query
+        
+        mock_supabase.table.side_effect = table
         
         result = client.get_timeline("user-123")
         
-        assert isinstance(result, list)
+        assert [(e["id"], e["hospital_name"], e["is_duplicate"]) for e in result] == [
+            ("1", "Apollo", True),
+            ("2", None, False),
+        ]
+        assert result[1]["status"] == "normal"
+        assert result[1]["category"] == "other"
 
 
 class TestDemoData:
     """Tests for demo data setup"""
 
-    @pytest.fixture
-    def mock_client(self):
-        with patch('database.supabase_client.create_client') as mock:
-            mock_supabase = MagicMock()
-            mock.return_value = mock_supabase
-            
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                from database.supabase_client import SupabaseClient
-                client = SupabaseClient()
-                yield client, mock_supabase
-
     def test_setup_demo_data_existing_user(self, mock_client):
         """Should return early if demo user exists"""
         client, mock_supabase = mock_client
-        mock_supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
+        query_result(mock_supabase, "select", "eq").data = [
             {"id": "demo-user-123", "name": "Rahul Kumar"}
         ]
         
@@ -557,37 +483,10 @@ class TestDemoData:
 class TestGetDbSingleton:
     """Tests for database singleton"""
 
-    def test_get_db_returns_instance(self):
-        """get_db should return SupabaseClient instance"""
+    def test_get_db_returns_shared_instance(self):
+        """get_db should build a SupabaseClient once and return it on every call"""
         with patch('database.supabase_client.create_client'):
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                # Reset singleton
-                import database.supabase_client as db_module
-                db_module._db_client = None
-                
-                from database.supabase_client import get_db
-                db = get_db()
-                
-                assert db is not None
-
-    def test_get_db_returns_same_instance(self):
-        """get_db should return same instance on multiple calls"""
-        with patch('database.supabase_client.create_client'):
-            with patch.dict(os.environ, {
-                'SUPABASE_URL': 'https://test.supabase.co',
-                'SUPABASE_KEY': 'test-key'
-            }):
-                # Reset singleton
-                import database.supabase_client as db_module
-                db_module._db_client = None
-                
-                from database.supabase_client import get_db
-                db1 = get_db()
-                db2 = get_db()
-                
-                assert db1 is db2
-
-
+            db = get_db()
+            
+            assert isinstance(db, SupabaseClient)
+            assert get_db() is db
@@ -3,11 +3,13 @@ Authentication utilities for password hashing and JWT token management.
 """
 
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import timedelta
 from typing import Optional, Dict, Any
 
 import bcrypt
-from jose import JWTError, jwt
+import jwt
+from jwt.exceptions import PyJWTError as JWTError
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,6 +19,15 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+ACCESS_TOKEN_EXPIRE_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+REFRESH_TOKEN_EXPIRE_SECONDS = REFRESH_TOKEN_EXPIRE_DAYS * 86400
+# Encoded once so PyJWT doesn't re-encode the key on every sign/verify
+_SECRET_BYTES = SECRET_KEY.encode('utf-8')
+
+# bcrypt work factor, read once at import. Each extra round doubles the cost;
+# raise BCRYPT_ROUNDS for deployments that can afford slower logins.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+_BCRYPT_PREFIX = b"2b"
 
 
 def hash_password(password: str) -> str:
@@ -29,9 +40,8 @@ def hash_password(password: str) -> str:
     Returns:
         Hashed password string
     """
-    password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS, prefix=_BCRYPT_PREFIX)
+    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
 
@@ -66,19 +76,20 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
         Encoded JWT token string
     """
     to_encode = data.copy()
+    now = int(time.time())
     
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + int(expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = now + ACCESS_TOKEN_EXPIRE_SECONDS
     
     to_encode.update({
         "exp": expire,
-        "iat": datetime.utcnow(),
+        "iat": now,
         "type": "access"
     })
     
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SECRET_BYTES, algorithm=ALGORITHM)
     return encoded_jwt
 
 
@@ -93,15 +104,15 @@ def create_refresh_token(data: Dict[str, Any]) -> str:
         Encoded JWT refresh token string
     """
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    now = int(time.time())
     
     to_encode.update({
-        "exp": expire,
-        "iat": datetime.utcnow(),
+        "exp": now + REFRESH_TOKEN_EXPIRE_SECONDS,
+        "iat": now,
         "type": "refresh"
     })
     
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SECRET_BYTES, algorithm=ALGORITHM)
     return encoded_jwt
 
 
@@ -116,18 +127,24 @@ def verify_token(token: str, token_type: str = "access") -> Optional[Dict[str, A
     Returns:
         Decoded token payload if valid, None otherwise
     """
+    # Anything that isn't header.payload.signature can't be ours; skip the
+    # base64/JSON/HMAC work for it
+    if not isinstance(token, str) or token.count(".") != 2:
+        return None
+    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # PyJWT checks the signature and rejects missing or expired claims
+        payload = jwt.decode(
+            token,
+            _SECRET_BYTES,
+            algorithms=[ALGORITHM],
+            options={"require": ["exp", "iat", "type"]},
+        )
         
         # Verify token type
         if payload.get("type") != token_type:
             return None
         
-        # Check expiration
-        exp = payload.get("exp")
-        if exp is None or datetime.utcnow().timestamp() > exp:
-            return None
-        
         return payload
         
     except JWTError:
@@ -145,6 +162,6 @@ def decode_token(token: str) -> Optional[Dict[str, Any]]:
         Decoded token payload or None if invalid
     """
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        return jwt.decode(token, _SECRET_BYTES, algorithms=[ALGORITHM])
     except JWTError:
         return None
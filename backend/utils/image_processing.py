@@ -2,16 +2,48 @@
 Image processing utilities for medical report uploads
 """
 
-import base64
+import hashlib
 import io
-from typing import Tuple, Optional
+import threading
+from collections import OrderedDict
+from typing import Iterable, Tuple, Optional
 from PIL import Image
 import PyPDF2
 
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib module
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    # Renders PDFs in-process; pdf2image (poppler subprocess) is the fallback
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
 
 # Maximum image size for Claude API (in bytes) - 20MB limit, we use 4MB for safety
 MAX_IMAGE_SIZE = 4 * 1024 * 1024  # 4MB
 MAX_DIMENSION = 2048  # Max width/height
+RESIZE_RESAMPLING = Image.Resampling.LANCZOS  # Filter for downscaling to MAX_DIMENSION
+JPEG_MAX_QUALITY = 85  # First (and best) quality tried when compressing
+JPEG_MIN_QUALITY = 25  # Floor; returned even if still over the size limit
+QUALITY_SEARCH_STEPS = 7  # Seed probe + full bisection of the 60 qualities below JPEG_MAX_QUALITY
+PDF_RENDER_DPI = 200  # Matches pdf2image's default
+MAX_PDF_TEXT_PAGES = 5  # Text fallback reads at most this many pages
+MAX_PDF_TEXT_CHARS = 20000  # ...and stops early once it has this much text
+MAX_DECLARED_DIMENSION = 20000  # Sanity bound on header-declared width/height
+KEEP_QUALITY_SLACK = 1.1  # JPEGs within 10% of the limit first try quality='keep'
+UPLOAD_CACHE_SIZE = 16  # Recent process_upload results kept for re-uploads (~6MB each max)
+
+# Leading magic bytes -> media type (WebP is checked separately: its tag is at offset 8)
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
 
 
 def compress_image(image_bytes: bytes, max_size: int = MAX_IMAGE_SIZE) -> bytes:
@@ -24,28 +56,75 @@ def compress_image(image_bytes: bytes, max_size: int = MAX_IMAGE_SIZE) -> bytes:
     # Open image
     img = Image.open(io.BytesIO(image_bytes))
     
-    # Convert to RGB if necessary (for JPEG compression)
-    if img.mode in ('RGBA', 'P'):
+    # A JPEG that's only slightly over often fits once its Huffman tables are
+    # optimized, re-encoding with its own quantization tables instead of
+    # searching for a lower quality
+    if (img.format == 'JPEG'
+            and img.width <= MAX_DIMENSION and img.height <= MAX_DIMENSION
+            and len(image_bytes) <= max_size * KEEP_QUALITY_SLACK):
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality='keep', optimize=True)
+        if buffer.tell() <= max_size:
+            return buffer.getvalue()
+    
+    # Convert to RGB if necessary (for JPEG compression). Transparent images
+    # are flattened onto white: convert('RGB') just drops alpha, which turns
+    # transparent regions black
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        img = Image.new('RGB', rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel('A'))
+    elif img.mode == 'P':
         img = img.convert('RGB')
     
-    # Resize if too large
+    # Resize if too large. thumbnail() calls draft() on a not-yet-loaded JPEG,
+    # so libjpeg already decodes at 1/2-1/8 scale (keeping 2x headroom for
+    # LANCZOS); no explicit draft() is needed here.
     if img.width > MAX_DIMENSION or img.height > MAX_DIMENSION:
-        img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+        img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), RESIZE_RESAMPLING)
     
-    # Compress with decreasing quality until under max size
-    quality = 85
-    while quality > 20:
+    def encode(quality: int) -> bytes:
+        # Progressive scans with 4:2:0 chroma come out ~5-15% smaller than
+        # baseline at the same quality, so the first probes fit more often.
+        # BytesIO over-allocates as it grows; pre-sizing it measured no faster.
         buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=quality, optimize=True)
-        compressed = buffer.getvalue()
-        
+        img.save(buffer, format='JPEG', quality=quality, optimize=True,
+                 progressive=True, subsampling='4:2:0')
+        return buffer.getvalue()
+    
+    compressed = encode(JPEG_MAX_QUALITY)
+    if len(compressed) <= max_size:
+        return compressed
+    
+    # Output size grows with quality, so binary-search the highest quality
+    # that fits instead of re-encoding at every step down to the floor. The
+    # first probe is estimated from how far over the limit the first encode
+    # was, which usually lands closer than the midpoint; the search then
+    # keeps bisecting until the range is exhausted, so a poor estimate costs
+    # extra probes rather than quality.
+    best = None
+    low, high = JPEG_MIN_QUALITY, JPEG_MAX_QUALITY - 1
+    quality = int(JPEG_MAX_QUALITY * max_size / len(compressed))
+    quality = max(low, min(high, quality))
+    for _ in range(QUALITY_SEARCH_STEPS):
+        if low > high:
+            break
+        compressed = encode(quality)
         if len(compressed) <= max_size:
-            return compressed
-        
-        quality -= 10
+            best = compressed
+            low = quality + 1
+        else:
+            high = quality - 1
+        quality = (low + high) // 2
     
-    # Return whatever we got at minimum quality
-    return compressed
+    if best is not None:
+        return best
+    
+    # Nothing fit; return the floor-quality encode (reusing the last probe
+    # if it already was the floor)
+    if high < JPEG_MIN_QUALITY:
+        return compressed
+    return encode(JPEG_MIN_QUALITY)
 
 
 def image_to_base64(image_bytes: bytes) -> str:
@@ -54,25 +133,22 @@ def image_to_base64(image_bytes: bytes) -> str:
     """
     # Compress if needed
     compressed = compress_image(image_bytes)
-    return base64.b64encode(compressed).decode('utf-8')
+    # Base64 output is pure ASCII, so skip the UTF-8 decoder's validation pass
+    return base64.b64encode(compressed).decode('ascii')
 
 
 def get_image_media_type(image_bytes: bytes) -> str:
     """
     Detect image media type from bytes
     """
-    # Check magic bytes
-    if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
-        return 'image/png'
-    elif image_bytes[:2] == b'\xff\xd8':
-        return 'image/jpeg'
-    elif image_bytes[:6] in (b'GIF87a', b'GIF89a'):
-        return 'image/gif'
-    elif image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+    # Check magic bytes; startswith compares in place without slicing copies
+    for signature, media_type in IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return media_type
+    if image_bytes.startswith(b'RIFF') and image_bytes.startswith(b'WEBP', 8):
         return 'image/webp'
-    else:
-        # Default to JPEG
-        return 'image/jpeg'
+    # Default to JPEG
+    return 'image/jpeg'
 
 
 def validate_image(image_bytes: bytes) -> Tuple[bool, Optional[str]]:
@@ -80,13 +156,18 @@ def validate_image(image_bytes: bytes) -> Tuple[bool, Optional[str]]:
     Validate that the bytes represent a valid image
     Returns (is_valid, error_message)
     """
+    # Check file size before parsing anything
+    if len(image_bytes) > 10 * 1024 * 1024:  # 10MB limit
+        return False, "Image size exceeds 10MB limit"
+    
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        img.verify()  # Verify it's a valid image
-        
-        # Check file size
-        if len(image_bytes) > 10 * 1024 * 1024:  # 10MB limit
-            return False, "Image size exceeds 10MB limit"
+        # verify() walks headers and chunk checksums without decoding pixels
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            # open() has already parsed the declared size; reject absurd
+            # dimensions before scanning the rest of the file
+            if img.width > MAX_DECLARED_DIMENSION or img.height > MAX_DECLARED_DIMENSION:
+                return False, f"Image dimensions exceed {MAX_DECLARED_DIMENSION}px limit"
+            img.verify()
         
         return True, None
     except Exception as e:
@@ -96,16 +177,30 @@ def validate_image(image_bytes: bytes) -> Tuple[bool, Optional[str]]:
 def extract_pdf_first_page(pdf_bytes: bytes) -> Optional[bytes]:
     """
     Extract the first page of a PDF as an image
-    Note: Requires poppler for pdf2image, fallback to text extraction
+    Note: Renders with pypdfium2 when installed, else pdf2image (needs poppler),
+    falling back to text extraction if neither works
     """
+    def to_jpeg(page_image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        page_image.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+    
     try:
+        if pdfium is not None:
+            # In-process render straight into a pixel buffer: no fork/exec and
+            # no PPM round-trip through a pipe
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                page_image = pdf[0].render(scale=PDF_RENDER_DPI / 72).to_pil()
+                return to_jpeg(page_image)
+            finally:
+                pdf.close()
+        
         # Try using pdf2image if poppler is available
         from pdf2image import convert_from_bytes
-        images = convert_from_bytes(pdf_bytes, first_page=1, last_page=1)
+        images = convert_from_bytes(pdf_bytes, dpi=PDF_RENDER_DPI, first_page=1, last_page=1)
         if images:
-            buffer = io.BytesIO()
-            images[0].save(buffer, format='JPEG', quality=85)
-            return buffer.getvalue()
+            return to_jpeg(images[0])
     except ImportError:
         pass
     except Exception:
@@ -114,27 +209,86 @@ def extract_pdf_first_page(pdf_bytes: bytes) -> Optional[bytes]:
     return None
 
 
+def _join_page_text(pages: Iterable[str]) -> str:
+    """
+    Join page texts, pulling no further pages once MAX_PDF_TEXT_CHARS is
+    reached (pages is a lazy generator, so later pages are never decoded)
+    """
+    parts = []
+    total = 0
+    for page_text in pages:
+        parts.append(page_text)
+        total += len(page_text)
+        if total >= MAX_PDF_TEXT_CHARS:
+            break
+    return "\n".join(parts).strip()
+
+
 def extract_pdf_text(pdf_bytes: bytes) -> str:
     """
     Extract text from PDF as fallback
     """
     try:
+        if pdfium is not None:
+            # PDFium's native text extractor, much faster than PyPDF2's
+            # pure-Python content-stream parsing
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                page_count = min(MAX_PDF_TEXT_PAGES, len(pdf))
+                return _join_page_text(
+                    pdf[index].get_textpage().get_text_range() for index in range(page_count)
+                )
+            finally:
+                pdf.close()
+        
         reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-        text = ""
-        for page in reader.pages[:5]:  # First 5 pages max
-            text += page.extract_text() + "\n"
-        return text.strip()
+        return _join_page_text(
+            page.extract_text() for page in reader.pages[:MAX_PDF_TEXT_PAGES]
+        )
     except Exception as e:
         return f"Error extracting PDF text: {str(e)}"
 
 
+# Retries and multi-step flows often resend the same document, so keep the
+# last few results keyed on a content hash. process_upload runs in worker
+# threads, hence the lock.
+_upload_cache: "OrderedDict[Tuple[bytes, str], Tuple[str, str, Optional[str]]]" = OrderedDict()
+_upload_cache_lock = threading.Lock()
+
+
+def clear_upload_cache() -> None:
+    """Drop all cached process_upload results"""
+    with _upload_cache_lock:
+        _upload_cache.clear()
+
+
 def process_upload(file_bytes: bytes, content_type: str) -> Tuple[str, str, Optional[str]]:
     """
     Process an uploaded file and return (base64_data, media_type, extracted_text)
     
     For images: returns base64 and media type
     For PDFs: attempts image conversion, falls back to text extraction
+    Identical re-uploads are served from a small LRU cache.
     """
+    key = (hashlib.sha256(file_bytes).digest(), content_type)
+    with _upload_cache_lock:
+        cached = _upload_cache.get(key)
+        if cached is not None:
+            _upload_cache.move_to_end(key)
+            return cached
+    
+    # Invalid images raise here and are never cached
+    result = _process_upload_uncached(file_bytes, content_type)
+    
+    with _upload_cache_lock:
+        _upload_cache[key] = result
+        if len(_upload_cache) > UPLOAD_CACHE_SIZE:
+            _upload_cache.popitem(last=False)
+    return result
+
+
+def _process_upload_uncached(file_bytes: bytes, content_type: str) -> Tuple[str, str, Optional[str]]:
+    """Do the actual work behind process_upload"""
     if content_type == 'application/pdf' or file_bytes[:4] == b'%PDF':
         # Try to convert PDF to image
         image_bytes = extract_pdf_first_page(file_bytes)
@@ -151,16 +305,22 @@ def process_upload(file_bytes: bytes, content_type: str) -> Tuple[str, str, Opti
         if not is_valid:
             raise ValueError(error)
         
-        base64_data = image_to_base64(file_bytes)
-        media_type = get_image_media_type(file_bytes)
+        # verify() leaves the Image unusable, so compress_image reopens it only
+        # when it's over the limit. Sniff the type from the bytes actually sent:
+        # an oversized PNG comes back as JPEG.
+        image_bytes = compress_image(file_bytes)
+        base64_data = base64.b64encode(image_bytes).decode('ascii')
+        media_type = get_image_media_type(image_bytes)
         return base64_data, media_type, None
 
 
 def get_image_dimensions(image_bytes: bytes) -> Tuple[int, int]:
     """
     Get image width and height
+    
+    Image.open only parses the header, so no pixel data is decoded.
     """
-    img = Image.open(io.BytesIO(image_bytes))
-    return img.size
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return img.size
 
 